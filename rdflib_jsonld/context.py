@@ -33,6 +33,9 @@ class Context(object):
         self._lookup = {}
         self._prefixes = {}
         self.active = False
+        # bumped on every mutation, so caches keyed on a context can tell
+        # whether their data is still current
+        self.version = 0
         if source:
             self.load(source)
 
@@ -104,6 +107,7 @@ class Context(object):
 
     def add_term(self, name, idref, coercion=UNDEF, container=UNDEF,
             language=UNDEF, reverse=False):
+        self.version += 1
         term = Term(idref, name, coercion, container, language, reverse)
         self.terms[name] = term
         self._lookup[(idref, coercion or language, container, reverse)] = term
@@ -186,7 +190,33 @@ class Context(object):
             return u":".join((pfx, name))
         return iri
 
+    def to_dict(self):
+        data = {}
+        if self.language:
+            data[LANG] = self.language
+        if self.vocab:
+            data[VOCAB] = self.vocab
+        for name, term in self.terms.items():
+            if (term.type is UNDEF and term.container is UNDEF
+                    and term.language is UNDEF and not term.reverse):
+                data[name] = term.id
+            else:
+                dfn = {}
+                if term.reverse:
+                    dfn[REV] = term.id
+                elif term.id is not UNDEF:
+                    dfn[ID] = term.id
+                if term.type is not UNDEF:
+                    dfn[TYPE] = term.type
+                if term.container is not UNDEF:
+                    dfn[CONTAINER] = term.container
+                if term.language is not UNDEF:
+                    dfn[LANG] = term.language
+                data[name] = dfn
+        return data
+
     def load(self, source, base=None):
+        self.version += 1
         self.active = True
         sources = []
         source = source if isinstance(source, list) else [source]
@@ -34,14 +34,16 @@ Example usage::
 
 """
 
-# NOTE: This code writes the entire JSON object into memory before serialising,
-# but we should consider streaming the output to deal with arbitrarily large
-# graphs.
+# NOTE: The tree of nodes is still built in memory by from_rdf, but the JSON
+# output is written to the stream one top-level node at a time, so no single
+# string holding the whole document is ever created.
 
+import codecs
 import warnings
+from math import isinf, isnan
+from weakref import WeakKeyDictionary
 
 from rdflib.serializer import Serializer
-from rdflib.graph import Graph
 from rdflib.term import URIRef, Literal, BNode
 from rdflib.namespace import RDF, XSD
 
@@ -50,11 +52,30 @@ from .context import Context, UNDEF
 from .util import json
 from .keys import CONTEXT, GRAPH, ID, VOCAB, LIST, SET, LANG
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 __all__ = ['JsonLDSerializer', 'from_rdf']
 
 
 PLAIN_LITERAL_TYPES = set([XSD.boolean, XSD.integer, XSD.double, XSD.string])
 
+_context_data_cache = WeakKeyDictionary()
+
+
+def _memoized(func):
+    """Cache results per positional arguments (for hashable arguments)."""
+    cache = {}
+    def wrapper(*args):
+        try:
+            return cache[args]
+        except KeyError:
+            result = cache[args] = func(*args)
+            return result
+    return wrapper
+
 
 class JsonLDSerializer(Serializer):
     def __init__(self, store):
@@ -68,6 +89,8 @@ class JsonLDSerializer(Serializer):
                           "Given encoding was: %s" % encoding)
 
         context_data = kwargs.get('context')
+        # compact against the given context, but emit it by reference
+        context_url = kwargs.get('context_url')
         use_native_types = kwargs.get('use_native_types', False),
         use_rdf_type = kwargs.get('use_rdf_type', False)
         auto_compact = kwargs.get('auto_compact', False)
@@ -81,10 +104,111 @@ class JsonLDSerializer(Serializer):
                 use_native_types, use_rdf_type,
                 auto_compact=auto_compact)
 
-        data = json.dumps(obj, indent=indent, separators=separators,
-                          sort_keys=sort_keys, ensure_ascii=ensure_ascii)
+        if context_url and isinstance(obj, dict) and CONTEXT in obj:
+            obj[CONTEXT] = context_url
+
+        # orjson encodes straight to utf-8 bytes in C; only usable when the
+        # requested options match the formatting it produces. Non-finite
+        # doubles are kept away from it (it would emit null where the
+        # stdlib emits Infinity/NaN); float reprs can still differ in
+        # formatting only (e.g. 1e-7 vs 1e-07).
+        if (orjson is not None and encoding == 'utf-8' and indent == 2
+                and separators == (',', ': ') and sort_keys
+                and not ensure_ascii and not _has_nonfinite(obj)):
+            try:
+                data = orjson.dumps(
+                    obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2)
+            except TypeError:
+                # e.g. integers beyond 64 bits; use the stdlib path
+                pass
+            else:
+                stream.write(data)
+                return
 
-        stream.write(data.encode(encoding, 'replace'))
+        writer = _StreamWriter(stream, encoding)
+        encoder = json.JSONEncoder(indent=indent, separators=separators,
+                sort_keys=sort_keys, ensure_ascii=ensure_ascii)
+        _write_json(writer, obj, encoder, indent, separators, sort_keys,
+                ensure_ascii)
+        writer.close()
+
+
+def _has_nonfinite(obj):
+    if isinstance(obj, float):
+        return isinf(obj) or isnan(obj)
+    if isinstance(obj, dict):
+        return any(_has_nonfinite(v) for v in obj.values())
+    if isinstance(obj, list):
+        return any(_has_nonfinite(v) for v in obj)
+    return False
+
+
+class _StreamWriter(object):
+    """Write text to a byte stream, encoding incrementally."""
+
+    def __init__(self, stream, encoding):
+        self._stream = stream
+        self._encoder = codecs.getincrementalencoder(encoding)('replace')
+
+    def write(self, text):
+        self._stream.write(self._encoder.encode(text))
+
+    def close(self):
+        data = self._encoder.encode(u'', True)
+        if data:
+            self._stream.write(data)
+
+
+def _write_json(writer, obj, encoder, indent, separators, sort_keys,
+        ensure_ascii, level=0, stream_depth=2):
+    # Emit the top levels of the object one child at a time, so only one
+    # node (not the entire document) is turned into a string at once. The
+    # output is identical to a single json.dumps call with the same options.
+    if not stream_depth or not isinstance(obj, (list, dict)) or not obj:
+        _write_encoded(writer, obj, encoder, indent, level)
+        return
+
+    item_sep, key_sep = separators
+    if indent is not None and not isinstance(indent, unicode):
+        indent = u' ' * max(indent, 0)
+    open_char, close_char = (u'[', u']') if isinstance(obj, list) else (
+            u'{', u'}')
+
+    writer.write(open_char)
+    if isinstance(obj, dict):
+        items = sorted(obj.items()) if sort_keys else obj.items()
+    else:
+        items = obj
+    first = True
+    for item in items:
+        if not first:
+            writer.write(item_sep)
+        first = False
+        if indent is not None:
+            writer.write(u'\n' + indent * (level + 1))
+        if isinstance(obj, dict):
+            key, value = item
+            writer.write(json.dumps(key, ensure_ascii=ensure_ascii) + key_sep)
+        else:
+            value = item
+        _write_json(writer, value, encoder, indent, separators, sort_keys,
+                ensure_ascii, level + 1, stream_depth - 1)
+    if indent is not None:
+        writer.write(u'\n' + indent * level)
+    writer.write(close_char)
+
+
+def _write_encoded(writer, obj, encoder, indent, level):
+    # newlines in JSON output only ever come from indentation (newlines
+    # inside strings are escaped), so re-indenting chunk by chunk is safe
+    pad = u''
+    if indent is not None and level:
+        unit = indent if isinstance(indent, unicode) else u' ' * max(indent, 0)
+        pad = unit * level
+    for chunk in encoder.iterencode(obj):
+        if pad:
+            chunk = chunk.replace(u'\n', u'\n' + pad)
+        writer.write(chunk)
 
 
 def from_rdf(graph, context_data=None, base=None,
@@ -101,7 +225,21 @@ def from_rdf(graph, context_data=None, base=None,
 
     if isinstance(context_data, Context):
         context = context_data
-        context_data = context.to_dict()
+        # pipelines serializing many graphs pass the same Context over and
+        # over; rebuild its dict form only when the context has changed
+        # since it was cached
+        cached = _context_data_cache.get(context)
+        if cached is not None and cached[0] == context.version:
+            context_data = cached[1]
+        else:
+            context_data = context.to_dict()
+            _context_data_cache[context] = (context.version, context_data)
+        # each caller gets its own copy, including the dict-valued term
+        # definitions (to_dict values are at most one level deep), so
+        # mutating the returned @context cannot poison the cache
+        context_data = dict(
+                (key, dict(dfn) if isinstance(dfn, dict) else dfn)
+                for key, dfn in context_data.items())
     else:
         context = Context(context_data, base=base)
 
@@ -116,39 +254,84 @@ def from_rdf(graph, context_data=None, base=None,
     return result
 
 
+class _Node(object):
+    """Per-subject accumulator, converted to a plain dict at emit time."""
+
+    __slots__ = ('iid', 'props')
+
+    def __init__(self, iid):
+        self.iid = iid
+        self.props = {}
+
+    def to_dict(self, id_key):
+        node = {id_key: self.iid}
+        node.update(self.props)
+        return node
+
+
 class Converter(object):
 
     def __init__(self, context, use_native_types, use_rdf_type):
         self.context = context
         self.use_native_types = context.active or use_native_types
         self.use_rdf_type = use_rdf_type
+        self._index = {}
+        self._coercers = {}
+        self._term_cache = {}
+        # The context is fully loaded by now, so its lookups can be
+        # memoized and its alias keys resolved once; these are otherwise
+        # recomputed for every triple.
+        # find_term keys are plain unicode and rdflib term equality is
+        # type-strict, so URIRefs must be converted; memoize so each
+        # distinct predicate or datatype is converted only once
+        self.to_unicode = _memoized(unicode)
+        self.shrink_iri = _memoized(context.shrink_iri)
+        self.to_symbol = _memoized(context.to_symbol)
+        self.find_term = _memoized(context.find_term)
+        self.id_key = context.id_key
+        self.type_key = context.type_key
+        # term defined for rdf:type, if any; the rdf:type fast path in
+        # add_to_node only applies when there is none
+        self._type_term = None
+        for coercion in (ID, VOCAB, UNDEF):
+            self._type_term = self.find_term(unicode(RDF.type), coercion, None)
+            if self._type_term:
+                break
+        self.value_key = context.value_key
+        self.lang_key = context.lang_key
+        self.list_key = context.list_key
 
     def convert(self, graph):
         # TODO: bug in rdflib dataset parsing (nquads et al):
         # plain triples end up in separate unnamed graphs (rdflib issue #436)
         if graph.context_aware:
-            default_graph = Graph()
-            graphs = [default_graph]
-            for g in graph.contexts():
-                if isinstance(g.identifier, URIRef):
-                    graphs.append(g)
-                else:
-                    default_graph += g
+            # bucket quads by named graph in one pass; copying the unnamed
+            # contexts into a scratch Graph rehashes every triple
+            buckets = {None: []}
+            for s, p, o, g in graph.quads((None, None, None, None)):
+                identifier = g.identifier
+                if not isinstance(identifier, URIRef):
+                    identifier = None
+                bucket = buckets.get(identifier)
+                if bucket is None:
+                    bucket = buckets[identifier] = []
+                bucket.append((s, p, o))
+            named_data = list(buckets.items())
         else:
-            graphs = [graph]
+            named_data = [(graph.identifier, graph)]
 
         context = self.context
 
         objs = []
-        for g in graphs:
+        for identifier, data in named_data:
             obj = {}
             graphname = None
 
-            if isinstance(g.identifier, URIRef):
-                graphname = context.shrink_iri(g.identifier)
-                obj[context.id_key] = graphname
+            if isinstance(identifier, URIRef):
+                graphname = self.shrink_iri(identifier)
+                obj[self.id_key] = graphname
 
-            nodes = self.from_graph(g)
+            nodes = self.from_graph(data)
 
             if not graphname and len(nodes) == 1:
                 obj.update(nodes[0])
@@ -162,7 +345,7 @@ class Converter(object):
             else:
                 objs.append(obj)
 
-        if len(graphs) == 1 and len(objs) == 1 and not self.context.active:
+        if len(named_data) == 1 and len(objs) == 1 and not self.context.active:
             default = objs[0]
             items = default.get(context.graph_key)
             if len(default) == 1 and items:
@@ -175,17 +358,48 @@ class Converter(object):
     def from_graph(self, graph):
         nodemap = {}
 
-        for s in set(graph.subjects()):
+        # one pass: group objects by subject and predicate, and note which
+        # bnodes are used as objects (per-subject graph.predicate_objects
+        # and any(graph.subjects(None, s)) probes are quadratic on most
+        # stores)
+        index = {}
+        referenced_bnodes = set()
+        referenced_add = referenced_bnodes.add
+        last_s, last_po = None, None
+        for s, p, o in graph:
+            # stores tend to yield triples in subject runs, so reuse the
+            # last subject's dict instead of a setdefault per triple (which
+            # allocates a throwaway default even on hits)
+            if s != last_s:
+                po = index.get(s)
+                if po is None:
+                    po = index[s] = {}
+                last_s, last_po = s, po
+            # objects are kept as dict keys: an ordered set, so the same
+            # triple showing up twice (e.g. in several unnamed contexts of
+            # a dataset) yields one value, as merging into a Graph used to
+            objs = last_po.get(p)
+            if objs is None:
+                last_po[p] = {o: None}
+            else:
+                objs[o] = None
+            if isinstance(o, BNode):
+                referenced_add(o)
+        self._index = index
+
+        process_subject = self.process_subject
+        for s in index:
             ## only iri:s and unreferenced (rest will be promoted to top if needed)
             if isinstance(s, URIRef) or (isinstance(s, BNode)
-                    and not any(graph.subjects(None, s))):
-                self.process_subject(graph, s, nodemap)
+                    and s not in referenced_bnodes):
+                process_subject(graph, s, nodemap)
 
-        return list(nodemap.values())
+        id_key = self.id_key
+        return [node.to_dict(id_key) for node in nodemap.values()]
 
     def process_subject(self, graph, s, nodemap):
         if isinstance(s, URIRef):
-            node_id = self.context.shrink_iri(s)
+            node_id = self.shrink_iri(s)
         elif isinstance(s, BNode):
             node_id = s.n3()
         else:
@@ -195,78 +409,105 @@ class Converter(object):
         if node_id in nodemap:
             return None
 
-        node = {}
-        node[self.context.id_key] = node_id
+        node = _Node(node_id)
         nodemap[node_id] = node
 
-        for p, o in graph.predicate_objects(s):
-            self.add_to_node(graph, s, p, o, node, nodemap)
+        # emit predicates in sorted order, so node keys come out in a
+        # deterministic order regardless of the store and callers that
+        # pass sort_keys=False still get stable output
+        add_to_node = self.add_to_node
+        for p, objs in sorted(self._index.get(s, {}).items()):
+            for o in objs:
+                add_to_node(graph, s, p, o, node, nodemap)
 
         return node
 
     def add_to_node(self, graph, s, p, o, s_node, nodemap):
         context = self.context
 
-        if isinstance(o, Literal):
-            datatype = unicode(o.datatype) if o.datatype else None
-            language = o.language
-            term = context.find_term(unicode(p), datatype, language=language)
-        else:
-            containers = [LIST, None] if graph.value(o, RDF.first) else [None]
-            for container in containers:
-                for coercion in (ID, VOCAB, UNDEF):
-                    term = context.find_term(unicode(p), coercion, container)
-                    if term:
-                        break
-                if term:
-                    break
-
         node = None
         use_set = not context.active
 
-        if term:
-            p_key = term.name
-
-            if term.type:
-                node = self.type_coerce(o, term.type)
-            elif term.language and o.language == term.language:
-                node = unicode(o)
-            elif context.language and (
-                    term.language is None and o.language is None):
-                node = unicode(o)
-
-            if term.container == SET:
-                use_set = True
-            elif term.container == LIST:
-                node = [self.type_coerce(v, term.type) or self.to_raw_value(graph, s, v, nodemap)
-                        for v in self.to_collection(graph, o)]
-            elif term.container == LANG and language:
-                value = s_node.setdefault(p_key, {})
-                values = value.get(language)
-                node = unicode(o)
-                if values:
-                    if not isinstance(values, list):
-                        value[language] = values = [values]
-                    values.append(node)
-                else:
-                    value[language] = node
-                return
+        # fast path for rdf:type with an IRI object: by far the most
+        # common predicate in typical data, and unless the context defines
+        # a term for it the generic lookup always lands in the same place
+        if (p == RDF.type and self._type_term is None
+                and not self.use_rdf_type and isinstance(o, URIRef)):
+            node = self.to_symbol(o)
+            p_key = self.type_key
 
         else:
-            p_key = context.to_symbol(p)
-            # TODO: for coercing curies - quite clumsy; unify to_symbol and find_term?
-            key_term = context.terms.get(p_key)
-            if key_term and (key_term.type or key_term.container):
-                p_key = p
-            if not term and p == RDF.type and not self.use_rdf_type:
-                if isinstance(o, URIRef):
-                    node = context.to_symbol(o)
-                p_key = context.type_key
+            if isinstance(o, Literal):
+                to_unicode = self.to_unicode
+                datatype = to_unicode(o.datatype) if o.datatype else None
+                language = o.language
+                term = self.find_term(to_unicode(p), datatype, UNDEF,
+                        language)
+            else:
+                # the coercion/container cascade is fixed per predicate
+                # (modulo the object being a list), so resolve it once and
+                # cache
+                is_list = RDF.first in self._index.get(o, ())
+                term = self._term_cache.get((p, is_list), UNDEF)
+                if term is UNDEF:
+                    containers = [LIST, None] if is_list else [None]
+                    term = None
+                    for container in containers:
+                        for coercion in (ID, VOCAB, UNDEF):
+                            term = self.find_term(self.to_unicode(p),
+                                    coercion, container)
+                            if term:
+                                break
+                        if term:
+                            break
+                    self._term_cache[(p, is_list)] = term
+
+            if term:
+                p_key = term.name
+
+                if term.type:
+                    node = self.type_coerce(o, term.type)
+                elif term.language and o.language == term.language:
+                    node = unicode(o)
+                elif context.language and (
+                        term.language is None and o.language is None):
+                    node = unicode(o)
+
+                if term.container == SET:
+                    use_set = True
+                elif term.container == LIST:
+                    type_coerce = self.type_coerce
+                    to_raw_value = self.to_raw_value
+                    node = [type_coerce(v, term.type) or to_raw_value(graph, s, v, nodemap)
+                            for v in self.to_collection(graph, o)]
+                elif term.container == LANG and language:
+                    value = s_node.props.setdefault(p_key, {})
+                    values = value.get(language)
+                    node = unicode(o)
+                    if values:
+                        if not isinstance(values, list):
+                            value[language] = values = [values]
+                        values.append(node)
+                    else:
+                        value[language] = node
+                    return
+
+            else:
+                p_key = self.to_symbol(p)
+                # TODO: for coercing curies - quite clumsy; unify to_symbol and find_term?
+                key_term = context.terms.get(p_key)
+                if key_term and (key_term.type or key_term.container):
+                    p_key = p
+                if not term and p == RDF.type and not self.use_rdf_type:
+                    if isinstance(o, URIRef):
+                        node = self.to_symbol(o)
+                    p_key = self.type_key
 
         if node is None:
             node = self.to_raw_value(graph, s, o, nodemap)
 
-        value = s_node.get(p_key)
+        props = s_node.props
+        value = props.get(p_key)
         if value:
             if not isinstance(value, list):
                 value = [value]
@@ -275,30 +516,61 @@ class Converter(object):
             value = [node]
         else:
             value = node
-        s_node[p_key] = value
+        props[p_key] = value
 
     def type_coerce(self, o, coerce_type):
+        coercer = self._coercers.get(coerce_type)
+        if coercer is None:
+            coercer = self._coercers[coerce_type] = self._make_coercer(
+                    coerce_type)
+        return coercer(o)
+
+    def _make_coercer(self, coerce_type):
+        # one concrete function per distinct coercion, picked once, instead
+        # of re-branching on coerce_type for every object
         if coerce_type == ID:
-            if isinstance(o, URIRef):
-                return self.context.shrink_iri(o)
-            elif isinstance(o, BNode):
-                return o.n3()
-            else:
-                return o
-        elif coerce_type == VOCAB and isinstance(o, URIRef):
-            return self.context.to_symbol(o)
-        elif isinstance(o, Literal) and unicode(o.datatype) == coerce_type:
-            return o
+            shrink_iri = self.shrink_iri
+            def coerce_id(o):
+                if isinstance(o, URIRef):
+                    return shrink_iri(o)
+                elif isinstance(o, BNode):
+                    return o.n3()
+                else:
+                    return o
+            return coerce_id
+        elif coerce_type == VOCAB:
+            to_symbol = self.to_symbol
+            def coerce_vocab(o):
+                if isinstance(o, URIRef):
+                    return to_symbol(o)
+                return None
+            return coerce_vocab
+        elif not coerce_type:
+            def coerce_none(o):
+                return None
+            return coerce_none
         else:
-            return None
+            # prebind the expected datatype so the per-object check is a
+            # direct term comparison, not a unicode() conversion per object
+            datatype = URIRef(coerce_type)
+            def coerce_datatype(o):
+                if isinstance(o, Literal) and o.datatype == datatype:
+                    return o
+                return None
+            return coerce_datatype
 
     def to_raw_value(self, graph, s, o, nodemap):
         context = self.context
-        coll = self.to_collection(graph, o)
+        # o is only worth a collection walk if it heads a list; the index
+        # answers that without calling into to_collection per object
+        if o == RDF.nil or RDF.first in self._index.get(o, ()):
+            coll = self.to_collection(graph, o)
+        else:
+            coll = None
         if coll is not None:
-            coll = [self.to_raw_value(graph, s, lo, nodemap)
-                    for lo in self.to_collection(graph, o)]
-            return {context.list_key: coll}
+            to_raw_value = self.to_raw_value
+            coll = [to_raw_value(graph, s, lo, nodemap) for lo in coll]
+            return {self.list_key: coll}
         elif isinstance(o, BNode):
             embed = False # TODO: self.context.active or using startnode and only one ref
             onode = self.process_subject(graph, o, nodemap)
@@ -306,11 +578,11 @@ class Converter(object):
                 if embed and not any(s2 for s2 in graph.subjects(None, o) if s2 != s):
                     return onode
                 else:
-                    nodemap[onode[context.id_key]] = onode
-            return {context.id_key: o.n3()}
+                    nodemap[onode.iid] = onode
+            return {self.id_key: o.n3()}
         elif isinstance(o, URIRef):
             # TODO: embed if o != startnode (else reverse)
-            return {context.id_key: context.shrink_iri(o)}
+            return {self.id_key: self.shrink_iri(o)}
         elif isinstance(o, Literal):
             # TODO: if compact
             native = self.use_native_types and o.datatype in PLAIN_LITERAL_TYPES
@@ -323,19 +595,21 @@ class Converter(object):
                     if self.context.active:
                         return v
                     else:
-                        return {context.value_key: v}
-                return {context.type_key: context.to_symbol(o.datatype),
-                        context.value_key: v}
+                        return {self.value_key: v}
+                return {self.type_key: self.to_symbol(o.datatype),
+                        self.value_key: v}
             elif o.language and o.language != context.language:
-                return {context.lang_key: o.language,
-                        context.value_key: v}
+                return {self.lang_key: o.language,
+                        self.value_key: v}
             elif not context.active or context.language and not o.language:
-                return {context.value_key: v}
+                return {self.value_key: v}
             else:
                 return v
 
     def to_collection(self, graph, l):
-        if l != RDF.nil and not graph.value(l, RDF.first):
+        # walks the prebuilt index only; no store lookups per list node
+        index = self._index
+        if l != RDF.nil and RDF.first not in index.get(l, ()):
             return None
         list_nodes = []
         chain = set([l])
@@ -345,13 +619,14 @@ class Converter(object):
             if isinstance(l, URIRef):
                 return None
             first, rest = None, None
-            for p, o in graph.predicate_objects(l):
-                if not first and p == RDF.first:
-                    first = o
-                elif not rest and p == RDF.rest:
-                    rest = o
-                elif p != RDF.type or o != RDF.List:
-                    return None
+            for p, objs in index.get(l, {}).items():
+                for o in objs:
+                    if not first and p == RDF.first:
+                        first = o
+                    elif not rest and p == RDF.rest:
+                        rest = o
+                    elif p != RDF.type or o != RDF.List:
+                        return None
             list_nodes.append(first)
             l = rest
             if l in chain:
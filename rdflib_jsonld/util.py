@@ -34,12 +34,25 @@ def source_to_json(source):
 
 VOCAB_DELIMS = ('#', '/', ':')
 
+_iri_splits = {}
+_IRI_SPLITS_MAX = 16384
+
 def split_iri(iri):
+    # memoized; a handful of vocabularies account for most IRIs in a
+    # typical graph, so the same split is requested over and over
+    result = _iri_splits.get(iri)
+    if result is not None:
+        return result
     for delim in VOCAB_DELIMS:
         at = iri.rfind(delim)
         if at > -1:
-            return iri[:at+1], iri[at+1:]
-    return iri, None
+            result = iri[:at+1], iri[at+1:]
+            break
+    else:
+        result = iri, None
+    if len(_iri_splits) < _IRI_SPLITS_MAX:
+        _iri_splits[iri] = result
+    return result
 
 def norm_url(base, url):
     """
@@ -2,7 +2,9 @@ from rdflib.plugin import register, Parser, Serializer
 register('json-ld', Parser, 'rdflib_jsonld.parser', 'JsonLDParser')
 register('json-ld', Serializer, 'rdflib_jsonld.serializer', 'JsonLDSerializer')
 
-from rdflib import Graph, Literal, URIRef
+import json
+
+from rdflib import BNode, ConjunctiveGraph, Graph, Literal, URIRef
 
 def test_parse():
     test_json = '''
@@ -24,3 +26,72 @@ def test_parse():
         URIRef('http://example.org/about'),
         URIRef('http://purl.org/dc/terms/title'),
         Literal("Someone's Homepage", lang='en'))]
+
+def test_serialize_dedups_repeated_triples():
+    triple = (
+        URIRef('http://example.org/about'),
+        URIRef('http://purl.org/dc/terms/title'),
+        Literal('Homepage'))
+    cg = ConjunctiveGraph()
+    cg.get_context(BNode()).add(triple)
+    cg.get_context(BNode()).add(triple)
+    nodes = json.loads(cg.serialize(format='json-ld').decode('utf-8'))
+    assert len(nodes) == 1
+    assert nodes[0]['http://purl.org/dc/terms/title'] == [
+            {'@value': 'Homepage'}]
+
+def test_serialize_context_by_reference():
+    g = Graph()
+    g.add((
+        URIRef('http://example.org/about'),
+        URIRef('http://purl.org/dc/terms/title'),
+        Literal('Homepage')))
+    context = {'dc': 'http://purl.org/dc/terms/'}
+    context_url = 'http://example.org/context.jsonld'
+    obj = json.loads(g.serialize(format='json-ld', context=context,
+            context_url=context_url).decode('utf-8'))
+    assert obj['@context'] == context_url
+    assert obj['dc:title'] == 'Homepage'
+
+def test_serialize_with_shared_context_object():
+    from rdflib_jsonld.context import Context
+    from rdflib_jsonld.serializer import from_rdf
+    context = Context({
+        'dc': 'http://purl.org/dc/terms/',
+        'updated': {'@id': 'http://purl.org/dc/terms/modified',
+                    '@type': 'http://www.w3.org/2001/XMLSchema#date'}})
+    g = Graph()
+    g.add((
+        URIRef('http://example.org/about'),
+        URIRef('http://purl.org/dc/terms/title'),
+        Literal('Homepage')))
+    obj1 = from_rdf(g, context)
+    obj2 = from_rdf(g, context)
+    assert obj1['dc:title'] == 'Homepage'
+    assert obj1['@context']['dc'] == 'http://purl.org/dc/terms/'
+    assert obj1['@context'] == obj2['@context']
+    # mutating a returned @context must not leak into later calls, not
+    # even inside a dict-valued term definition
+    obj1['@context']['extra'] = 'http://example.org/extra'
+    obj1['@context']['updated']['@type'] = 'POISON'
+    obj3 = from_rdf(g, context)
+    assert 'extra' not in obj3['@context']
+    assert obj3['@context']['updated']['@type'] == \
+            'http://www.w3.org/2001/XMLSchema#date'
+
+def test_serialize_with_modified_context_object():
+    from rdflib_jsonld.context import Context
+    from rdflib_jsonld.serializer import from_rdf
+    context = Context({'dc': 'http://purl.org/dc/terms/'})
+    g = Graph()
+    g.add((
+        URIRef('http://example.org/about'),
+        URIRef('http://purl.org/dc/terms/title'),
+        Literal('Homepage')))
+    assert 'title' not in from_rdf(g, context)['@context']
+    # loading more terms must invalidate the cached dict form, so the
+    # embedded @context still matches what the output was compacted with
+    context.load({'title': 'http://purl.org/dc/terms/title'})
+    obj = from_rdf(g, context)
+    assert obj['@context']['title'] == 'http://purl.org/dc/terms/title'
+    assert obj['title'] == 'Homepage'
@@ -167,3 +167,25 @@ def test_invalid_remote_context():
     ctx_url = "http://example.org/recursive.jsonld"
     SOURCES[ctx_url] = {"key": "value"}
     ctx = Context(ctx_url)
+
+def test_to_dict():
+    ctx = Context({
+        '@vocab': 'http://example.org/ns/',
+        '@language': 'en',
+        'id': '@id',
+        'label': 'http://example.org/ns/label',
+        'updated': {'@id': 'http://example.org/ns/updated',
+                    '@type': 'http://www.w3.org/2001/XMLSchema#date'},
+        'authors': {'@id': 'http://example.org/ns/author',
+                    '@container': '@set'},
+    })
+    assert ctx.to_dict() == {
+        '@vocab': 'http://example.org/ns/',
+        '@language': 'en',
+        'id': '@id',
+        'label': 'http://example.org/ns/label',
+        'updated': {'@id': 'http://example.org/ns/updated',
+                    '@type': 'http://www.w3.org/2001/XMLSchema#date'},
+        'authors': {'@id': 'http://example.org/ns/author',
+                    '@container': '@set'},
+    }